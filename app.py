@@ -4,16 +4,52 @@ Carga datos de clientes desde CSV, permite filtrar por sucursal,
 visualizar en mapa interactivo y analizar distancias a puntos propuestos.
 """
 
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 import logging
+import math
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
-from io import StringIO
 import os
-from services.distance import calculate_distance_km
+from services.distance import (
+    calculate_distance_km, coordenadas_esfera, count_less, haversine_km, haversine_multi,
+    precompute_trig, radio_cuerda
+)
+from services.optimo import geometric_median
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 
 app = Flask(__name__)
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON basado en orjson: serializa las respuestas grandes
+    (detalle de clientes) sin pasar por el módulo json de Python.
+    """
+    option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
@@ -23,6 +59,146 @@ logger = logging.getLogger(__name__)
 clientes_df = None
 clientes_excluidos_df = None  # Clientes fuera de rango
 sucursales_df = None  # Coordenadas de sucursales reales
+SUC_COORDS = {}  # sucursal -> (lat, lon) de la sucursal real
+
+# Índice por sucursal (SoA) construido una vez tras cada carga de clientes.
+# Cada sucursal tiene un único registro inmutable y el diccionario completo se
+# reemplaza con una sola asignación: una petición que toma el registro una vez
+# usa siempre coordenadas, columnas, KD-tree y óptimo de la misma carga
+IndiceSucursal = namedtuple('IndiceSucursal', [
+    'lat',     # array float32 de latitudes
+    'lon',     # array float32 de longitudes
+    'meta',    # DataFrame con columnas de presentación
+    'trig',    # (lat_rad, lon_rad, cos_lat_rad) precalculados
+    'tree',    # cKDTree sobre coordenadas en la esfera unitaria (None sin scipy)
+    'optimo',  # (lat, lon) del óptimo precalculado
+])
+INDICE_SUCURSALES = {}  # sucursal -> IndiceSucursal
+
+# Columnas de clientes que se devuelven al frontend
+COLUMNAS_CLIENTE = ['Cod Local', 'Local', 'Sucursal', 'Zona Reparto', 'lat', 'lon']
+
+# Filas por bloque al generar la exportación CSV en streaming
+FILAS_POR_BLOQUE_CSV = 10000
+
+# Coordenadas con o sin paréntesis/espacios: "(-23.65129,-70.38372)", "-23.65, -70.38"
+# Anclado al texto completo: valores con basura adicional quedan como NaN
+_COORD_RE = re.compile(r'^\s*\(?\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\)?\s*$')
+
+
+def _parse_coords_series(s: pd.Series, dtype='float32') -> pd.DataFrame:
+    """
+    Separa una Serie de coordenadas en texto en dos columnas numéricas (lat, lon).
+    Usa un único regex vectorizado; los valores que no calzan quedan como NaN.
+    Por defecto usa float32: la precisión (~1e-5 grados, ~1 m) alcanza para
+    coordenadas GPS y reduce a la mitad la memoria recorrida en cada cálculo.
+    """
+    partes = s.astype('string').str.extract(_COORD_RE, expand=True)
+    partes.columns = ['lat', 'lon']
+    return partes.astype(dtype)
+
+
+def _coords_presentacion(valores):
+    """
+    Convierte coordenadas float32 a float64 para JSON/CSV pasando por su
+    representación decimal más corta, de modo que -70.38372 se muestre así
+    y no como -70.38372039794922.
+    """
+    return np.asarray(valores).astype(str).astype(np.float64)
+
+
+def _separar_clientes_chile(df):
+    """
+    Separa los clientes con coordenadas en Chile continental (lat entre -56
+    y -17, lon entre -76 y -66) de los que quedan fuera de ese rango.
+    Las filas sin coordenadas (NaN) se descartan. Las máscaras se calculan en
+    una sola pasada sobre los arrays, en lugar de dropna + filtro.
+    Retorna la tupla (validos, excluidos).
+    """
+    lat = df['lat'].to_numpy()
+    lon = df['lon'].to_numpy()
+    con_coords = ~(np.isnan(lat) | np.isnan(lon))
+    # Las comparaciones con NaN son False: las filas sin coordenadas no quedan en chile
+    chile = (lat >= -56) & (lat <= -17) & (lon >= -76) & (lon <= -66)
+    return df[chile], df[con_coords & ~chile]
+
+
+def _leer_cache_parquet(origen, destino):
+    """
+    Lee la copia Parquet de un archivo de datos ya procesado (coordenadas
+    separadas en 'lat'/'lon'). Retorna None si no existe, si quedó
+    desactualizada respecto al archivo de origen o si no se puede leer.
+    """
+    marca_path = destino + '.mtime'
+    if not (os.path.exists(origen) and os.path.exists(destino) and os.path.exists(marca_path)):
+        return None
+    try:
+        with open(marca_path, encoding='utf-8') as f:
+            if f.read().strip() != repr(os.path.getmtime(origen)):
+                return None
+        return pd.read_parquet(destino, engine='pyarrow')
+    except Exception as e:
+        logger.debug("No se pudo usar el caché %s: %s", destino, e)
+        return None
+
+
+def _escribir_cache_parquet(df, origen, destino):
+    """
+    Guarda df en formato Parquet junto con la fecha de modificación del
+    archivo de origen, para reutilizarlo en el siguiente inicio.
+    """
+    try:
+        df.to_parquet(destino, engine='pyarrow', compression='zstd', index=False)
+        with open(destino + '.mtime', 'w', encoding='utf-8') as f:
+            f.write(repr(os.path.getmtime(origen)))
+    except Exception as e:
+        logger.debug("No se pudo escribir el caché %s: %s", destino, e)
+
+
+def construir_indice_sucursales():
+    """
+    Precalcula, por sucursal, las coordenadas como arrays NumPy contiguos,
+    un DataFrame con las columnas de presentación, (si scipy está
+    disponible) un KD-tree para búsquedas por radio y el punto óptimo.
+    Evita filtrar y copiar clientes_df completo en cada petición.
+    """
+    global INDICE_SUCURSALES
+    # Se construye todo (óptimos incluidos) en un diccionario local y se
+    # publica al final con una sola asignación
+    registros = {}
+
+    if clientes_df is not None and len(clientes_df) > 0:
+        lat_all = clientes_df['lat'].to_numpy(dtype=np.float32)
+        lon_all = clientes_df['lon'].to_numpy(dtype=np.float32)
+        lat_pres = _coords_presentacion(lat_all)
+        lon_pres = _coords_presentacion(lon_all)
+        # Radianes y coseno de la latitud de cada cliente: sólo dependen de los
+        # datos, así que se calculan una vez y no en cada petición
+        lat_rad_all, lon_rad_all, cos_lat_all = precompute_trig(lat_all, lon_all)
+        for sucursal, idx in clientes_df.groupby('Sucursal', sort=False).indices.items():
+            lat, lon = lat_all[idx], lon_all[idx]
+            registros[sucursal] = IndiceSucursal(
+                lat=lat,
+                lon=lon,
+                meta=clientes_df.iloc[idx][COLUMNAS_CLIENTE].assign(
+                    lat=lat_pres[idx], lon=lon_pres[idx]
+                ),
+                trig=(lat_rad_all[idx], lon_rad_all[idx], cos_lat_all[idx]),
+                tree=cKDTree(coordenadas_esfera(lat, lon)) if cKDTree is not None else None,
+                optimo=None,
+            )
+
+        # Óptimo de todas las sucursales en paralelo (el kernel de Weiszfeld
+        # libera el GIL), para servir /api/sugerir_optimo y /api/analisis_punto
+        # con una búsqueda en diccionario
+        with ThreadPoolExecutor() as ex:
+            optimos = list(ex.map(calcular_punto_optimo_sucursal, registros.values()))
+        registros = {
+            sucursal: registro._replace(optimo=optimo)
+            for (sucursal, registro), optimo in zip(registros.items(), optimos)
+        }
+
+    INDICE_SUCURSALES = registros
 
 
 def cargar_datos_clientes():
@@ -32,43 +208,26 @@ def cargar_datos_clientes():
     """
     global clientes_df, clientes_excluidos_df
     csv_path = os.path.join('data', 'clientes.csv')
+    parquet_path = os.path.join('data', 'clientes.parquet')
     
     try:
-        # Leer CSV con punto y coma como delimitador
-        df = pd.read_csv(csv_path, sep=';')
-        
-        logger.info("Archivo CSV leído: %d filas", len(df))
-        logger.debug("Columnas: %s", df.columns.tolist())
-        
-        # Procesar columna Coordenadas: "(-23.65129,-70.38372)" -> lat, lon
-        def extraer_coordenadas(coord_str):
-            try:
-                # Convertir a string por si acaso
-                coord_str = str(coord_str).strip()
-                # Eliminar paréntesis y espacios
-                coord_str = coord_str.replace('(', '').replace(')', '').replace(' ', '')
-                # Separar por coma
-                lat_str, lon_str = coord_str.split(',')
-                return float(lat_str), float(lon_str)
-            except Exception as e:
-                logger.debug("Error procesando coordenada '%s': %s", coord_str, e)
-                return np.nan, np.nan
-        
-        # Aplicar extracción de coordenadas
-        df[['lat', 'lon']] = df['Coordenadas'].apply(
-            lambda x: pd.Series(extraer_coordenadas(x))
-        )
-        
-        # Eliminar filas con coordenadas inválidas
-        df = df.dropna(subset=['lat', 'lon'])
+        # Reutilizar la copia Parquet ya procesada si el CSV no cambió
+        df = _leer_cache_parquet(csv_path, parquet_path)
+        if df is not None:
+            logger.info("Clientes leídos desde caché Parquet: %d filas", len(df))
+        else:
+            # Leer CSV con punto y coma como delimitador
+            df = pd.read_csv(csv_path, sep=';')
+            
+            logger.info("Archivo CSV leído: %d filas", len(df))
+            logger.debug("Columnas: %s", df.columns.tolist())
+            
+            # Procesar columna Coordenadas: "(-23.65129,-70.38372)" -> lat, lon
+            df[['lat', 'lon']] = _parse_coords_series(df['Coordenadas'])
+            _escribir_cache_parquet(df, csv_path, parquet_path)
 
-        # Filtro: Chile continental (lat entre -56 y -17, lon entre -76 y -66)
-        filtro_chile = (
-            (df['lat'] >= -56) & (df['lat'] <= -17) &
-            (df['lon'] >= -76) & (df['lon'] <= -66)
-        )
-        clientes_df = df[filtro_chile].copy()
-        clientes_excluidos_df = df[~filtro_chile].copy()
+        # Descartar coordenadas inválidas y filtrar Chile continental
+        clientes_df, clientes_excluidos_df = _separar_clientes_chile(df)
 
         logger.info("Clientes válidos: %d", len(clientes_df))
         logger.info("Clientes excluidos (fuera de Chile): %d", len(clientes_excluidos_df))
@@ -98,37 +257,36 @@ def cargar_datos_clientes():
             'Coordenadas', 'lat', 'lon'
         ])
 
+    construir_indice_sucursales()
+
 
 def cargar_datos_sucursales():
     """
     Carga el Excel de sucursales y procesa las coordenadas.
     Formato esperado: columnas 'Sucursal' y 'Coordenadas'.
     """
-    global sucursales_df
+    global sucursales_df, SUC_COORDS
     excel_path = os.path.join('data', 'Sucursales.xlsx')
+    parquet_path = os.path.join('data', 'Sucursales.parquet')
     
     try:
-        df = pd.read_excel(excel_path)
-        
-        logger.info("Excel de sucursales leído: %d filas", len(df))
-        logger.debug("Columnas sucursales: %s", df.columns.tolist())
-        
-        # Procesar columna Coordenadas
-        def extraer_coordenadas(coord_str):
-            try:
-                coord_str = str(coord_str).strip()
-                coord_str = coord_str.replace('(', '').replace(')', '').replace(' ', '')
-                lat_str, lon_str = coord_str.split(',')
-                return float(lat_str), float(lon_str)
-            except Exception as e:
-                logger.debug("Error procesando coordenada de sucursal '%s': %s", coord_str, e)
-                return np.nan, np.nan
-        
-        df[['lat', 'lon']] = df['Coordenadas'].apply(
-            lambda x: pd.Series(extraer_coordenadas(x))
-        )
-        
-        df = df.dropna(subset=['lat', 'lon'])
+        # Reutilizar la copia Parquet ya procesada si el Excel no cambió
+        df = _leer_cache_parquet(excel_path, parquet_path)
+        if df is None:
+            # openpyxl ya abre el libro en modo read_only dentro de pandas (pasar
+            # read_only en engine_kwargs falla por argumento duplicado); basta
+            # con fijar el motor y leer sólo las columnas necesarias
+            df = pd.read_excel(excel_path, engine='openpyxl', usecols=['Sucursal', 'Coordenadas'])
+            
+            logger.info("Excel de sucursales leído: %d filas", len(df))
+            logger.debug("Columnas sucursales: %s", df.columns.tolist())
+            
+            # Procesar columna Coordenadas (float64: son pocas filas y se
+            # devuelven tal cual al frontend)
+            df[['lat', 'lon']] = _parse_coords_series(df['Coordenadas'], dtype='float64')
+            
+            df = df.dropna(subset=['lat', 'lon'])
+            _escribir_cache_parquet(df, excel_path, parquet_path)
         sucursales_df = df
         
         logger.info("Sucursales cargadas: %d", len(sucursales_df))
@@ -141,9 +299,19 @@ def cargar_datos_sucursales():
         logger.exception("ERROR cargando sucursales: %s", e)
         sucursales_df = pd.DataFrame(columns=['Sucursal', 'Coordenadas', 'lat', 'lon'])
 
+    # Índice nombre -> (lat, lon) para búsquedas O(1); ante nombres repetidos
+    # se conserva la primera fila, igual que el filtro + iloc[0] anterior
+    unicas = sucursales_df.drop_duplicates('Sucursal')
+    SUC_COORDS = dict(zip(
+        unicas['Sucursal'].tolist(),
+        zip(unicas['lat'].astype(float).tolist(), unicas['lon'].astype(float).tolist())
+    ))
+
 
 # --- Upload endpoint for clientes (temporary, in-memory) ---
 ALLOWED_CLIENTES_EXT = {'.csv'}
+# Filas por bloque al leer el CSV subido (acota el uso de memoria)
+FILAS_POR_BLOQUE_UPLOAD = 200_000
 
 
 @app.route('/upload_clientes', methods=['POST'])
@@ -163,30 +331,23 @@ def upload_clientes():
         return jsonify({'error': 'Extensión de archivo no permitida. Use .csv'}), 400
 
     try:
-        # Leer CSV directamente desde el objeto FileStorage
+        # Leer CSV directamente desde el objeto FileStorage, por bloques
         # Intentamos con separador ';' por compatibilidad con el maestro original
-        df = pd.read_csv(file, sep=';')
-
-        # Procesar columna Coordenadas
-        def extraer_coordenadas(coord_str):
-            try:
-                coord_str = str(coord_str).strip()
-                coord_str = coord_str.replace('(', '').replace(')', '').replace(' ', '')
-                lat_str, lon_str = coord_str.split(',')
-                return float(lat_str), float(lon_str)
-            except Exception:
-                return np.nan, np.nan
-
-        df[['lat', 'lon']] = df['Coordenadas'].apply(lambda x: pd.Series(extraer_coordenadas(x)))
-        df = df.dropna(subset=['lat', 'lon'])
-
-        # Filtrar Chile continental
-        filtro_chile = (
-            (df['lat'] >= -56) & (df['lat'] <= -17) &
-            (df['lon'] >= -76) & (df['lon'] <= -66)
-        )
-        clientes_df = df[filtro_chile].copy()
-        clientes_excluidos_df = df[~filtro_chile].copy()
+        reader = pd.read_csv(file, sep=';', chunksize=FILAS_POR_BLOQUE_UPLOAD)
+
+        validos, excluidos = [], []
+        for chunk in reader:
+            # Procesar columna Coordenadas
+            chunk[['lat', 'lon']] = _parse_coords_series(chunk['Coordenadas'])
+
+            # Descartar coordenadas inválidas y filtrar Chile continental
+            validos_chunk, excluidos_chunk = _separar_clientes_chile(chunk)
+            validos.append(validos_chunk)
+            excluidos.append(excluidos_chunk)
+
+        clientes_df = pd.concat(validos, copy=False)
+        clientes_excluidos_df = pd.concat(excluidos, copy=False)
+        construir_indice_sucursales()
 
         return jsonify({
             'ok': True,
@@ -199,52 +360,23 @@ def upload_clientes():
 
 
 # --- NUEVO: Función para sugerir punto óptimo (geometric median) ---
-def calcular_punto_optimo_sucursal(sucursal):
+def calcular_punto_optimo_sucursal(registro):
     """
     Calcula el punto óptimo para ubicar la sucursal usando el geometric median (Weiszfeld algorithm).
     Este punto minimiza la suma de distancias a todos los clientes.
-    Retorna lat, lon del óptimo o None si no hay clientes.
+    Recibe el IndiceSucursal (con al menos un cliente) y retorna lat, lon del óptimo.
+    Se llama una vez por sucursal al construir el índice.
     """
-    global clientes_df
-    df = clientes_df[clientes_df['Sucursal'] == sucursal]
-    if len(df) == 0:
-        return None, None
-    
-    # Extraer coordenadas
-    coords = df[['lat', 'lon']].values
-    
-    # Si hay un solo cliente, el óptimo es ese cliente
-    if len(coords) == 1:
-        return float(coords[0][0]), float(coords[0][1])
-    
-    # Iniciar con el centroide como estimación inicial
-    punto_actual = coords.mean(axis=0)
+    # Coordenadas precalculadas como arrays contiguos para el kernel de Weiszfeld
+    coords_lat = registro.lat
+    coords_lon = registro.lon
     
-    # Algoritmo de Weiszfeld para encontrar el geometric median
-    max_iteraciones = 100
-    tolerancia = 1e-6
+    # Si hay un solo cliente, el óptimo es ese cliente (con sus coordenadas
+    # de presentación: float(coords_lat[0]) daría -33.400002 en vez de -33.4)
+    if len(coords_lat) == 1:
+        return float(registro.meta['lat'].iat[0]), float(registro.meta['lon'].iat[0])
     
-    for _ in range(max_iteraciones):
-        # Calcular distancias desde punto actual a cada cliente
-        distancias = np.sqrt(np.sum((coords - punto_actual) ** 2, axis=1))
-        
-        # Evitar división por cero
-        distancias = np.where(distancias < 1e-8, 1e-8, distancias)
-        
-        # Calcular pesos inversamente proporcionales a las distancias
-        pesos = 1.0 / distancias
-        suma_pesos = pesos.sum()
-        
-        # Calcular nuevo punto como promedio ponderado
-        punto_nuevo = (coords.T @ pesos) / suma_pesos
-        
-        # Verificar convergencia
-        if np.linalg.norm(punto_nuevo - punto_actual) < tolerancia:
-            break
-        
-        punto_actual = punto_nuevo
-    
-    return float(punto_actual[0]), float(punto_actual[1])
+    return geometric_median(coords_lat, coords_lon)
 
 
 # --- NUEVO: Endpoint para sugerir punto óptimo ---
@@ -253,9 +385,10 @@ def api_sugerir_optimo():
     sucursal = request.args.get('sucursal', '')
     if not sucursal:
         return jsonify({'error': 'Parámetro sucursal requerido'}), 400
-    lat_opt, lon_opt = calcular_punto_optimo_sucursal(sucursal)
-    if lat_opt is None or lon_opt is None:
+    registro = INDICE_SUCURSALES.get(sucursal)
+    if registro is None:
         return jsonify({'error': 'No hay clientes para esta sucursal'}), 404
+    lat_opt, lon_opt = registro.optimo
     return jsonify({
         'sucursal': sucursal,
         'lat_optimo': round(lat_opt, 6),
@@ -266,21 +399,20 @@ def api_sugerir_optimo():
 # --- NUEVO: Endpoint para obtener ubicación de sucursal real ---
 @app.route('/api/sucursal_ubicacion')
 def api_sucursal_ubicacion():
-    global sucursales_df
     sucursal = request.args.get('sucursal', '')
     if not sucursal:
         return jsonify({'error': 'Parámetro sucursal requerido'}), 400
-    if sucursales_df is None or len(sucursales_df) == 0:
+    if not SUC_COORDS:
         return jsonify({'error': 'No hay datos de sucursales'}), 404
     
-    suc_data = sucursales_df[sucursales_df['Sucursal'] == sucursal]
-    if len(suc_data) == 0:
+    lat, lon = SUC_COORDS.get(sucursal, (None, None))
+    if lat is None:
         return jsonify({'error': f'Sucursal {sucursal} no encontrada'}), 404
     
     return jsonify({
         'sucursal': sucursal,
-        'lat': float(suc_data.iloc[0]['lat']),
-        'lon': float(suc_data.iloc[0]['lon'])
+        'lat': lat,
+        'lon': lon
     })
 
 
@@ -293,7 +425,10 @@ def api_clientes_excluidos():
         return jsonify({'excluidos': [], 'total': 0})
     excluidos = clientes_excluidos_df[[
         'Cod Local', 'Local', 'Sucursal', 'Zona Reparto', 'lat', 'lon'
-    ]].to_dict('records')
+    ]].assign(
+        lat=_coords_presentacion(clientes_excluidos_df['lat']),
+        lon=_coords_presentacion(clientes_excluidos_df['lon'])
+    ).to_dict('records')
     return jsonify({'excluidos': excluidos, 'total': len(excluidos)})
 
 
@@ -323,19 +458,14 @@ def api_clientes_por_sucursal():
     if not sucursal:
         return jsonify({'error': 'Parámetro sucursal requerido'}), 400
     
-    # Filtrar clientes por sucursal
-    clientes_filtrados = clientes_df[
-        clientes_df['Sucursal'] == sucursal
-    ].copy()
+    # Clientes de la sucursal desde el índice precalculado
+    registro = INDICE_SUCURSALES.get(sucursal)
     
-    if len(clientes_filtrados) == 0:
+    if registro is None or len(registro.meta) == 0:
         return jsonify({'clientes': []})
     
     # Preparar datos para el frontend
-    clientes_list = clientes_filtrados[[
-        'Cod Local', 'Local', 'Sucursal', 
-        'Zona Reparto', 'lat', 'lon'
-    ]].to_dict('records')
+    clientes_list = registro.meta.to_dict('records')
     
     return jsonify({
         'clientes': clientes_list,
@@ -369,97 +499,87 @@ def api_analisis_punto():
     except ValueError:
         return jsonify({'error': 'Valores numéricos inválidos'}), 400
     
-    # Filtrar clientes por sucursal
-    clientes_filtrados = clientes_df[
-        clientes_df['Sucursal'] == sucursal
-    ].copy()
+    # Clientes de la sucursal desde el índice precalculado (sin copiar); el
+    # registro se toma una sola vez para que todo el análisis use la misma carga
+    registro = INDICE_SUCURSALES.get(sucursal)
     
-    if len(clientes_filtrados) == 0:
+    if registro is None or len(registro.meta) == 0:
         return jsonify({'error': 'No hay clientes para esta sucursal'}), 404
+    meta = registro.meta
     
-    # Calcular distancias usando el módulo de distancia
-    # HOY: Haversine (modo por defecto)
-    # MAÑANA: se puede cambiar a mode="osrm" cuando esté implementado
-    distancias_km = calculate_distance_km(
-        clientes_filtrados, 
-        lat_click, 
-        lon_click, 
-        mode="haversine"
-    )
+    # Obtener coordenadas de sucursal real
+    lat_real, lon_real = SUC_COORDS.get(sucursal, (None, None))
+    
+    # Obtener coordenadas del óptimo sugerido (precalculado en el índice)
+    lat_optimo, lon_optimo = registro.optimo
     
-    # Agregar distancias al DataFrame filtrado
-    clientes_filtrados['distancia_km'] = distancias_km
-    clientes_filtrados['costo_estimado'] = distancias_km * costo_km
+    # Calcular en una sola pasada las distancias de los clientes al punto
+    # consultado (fila 0), a la sucursal real y al óptimo (si existen)
+    refs = [(lat_click, lon_click)]
+    if lat_real is not None:
+        refs.append((lat_real, lon_real))
+    if lat_optimo is not None:
+        refs.append((lat_optimo, lon_optimo))
+    distancias = haversine_multi(None, None, refs, precomputed=registro.trig)
+    distancias_km = distancias[0]
     
     # Calcular estadísticas básicas
-    distancia_promedio = float(distancias_km.mean())
+    distancia_promedio = float(distancias_km.mean(dtype=np.float64))
     distancia_minima = float(distancias_km.min())
     distancia_maxima = float(distancias_km.max())
-    numero_clientes = len(clientes_filtrados)
+    numero_clientes = len(meta)
     costo_promedio = distancia_promedio * costo_km
     
     # --- NUEVAS MÉTRICAS: Comparación con sucursal real y óptimo ---
     metricas_comparativas = {}
     
-    # Obtener coordenadas de sucursal real
-    if sucursales_df is not None and len(sucursales_df) > 0:
-        suc_real = sucursales_df[sucursales_df['Sucursal'] == sucursal]
-        if len(suc_real) > 0:
-            lat_real = float(suc_real.iloc[0]['lat'])
-            lon_real = float(suc_real.iloc[0]['lon'])
-            
-            # Calcular distancias de clientes a sucursal real
-            distancias_real = calculate_distance_km(
-                clientes_filtrados, lat_real, lon_real, mode="haversine"
-            )
-            distancia_promedio_real = float(distancias_real.mean())
-            costo_promedio_real = distancia_promedio_real * costo_km
-            
-            # Distancia entre punto consultado y sucursal real
-            from services.distance import haversine_km
-            dist_consultado_real = haversine_km(lat_click, lon_click, lat_real, lon_real)
-            
-            # Clientes más cercanos a cada ubicación
-            clientes_mas_cerca_consultado = int((distancias_km < distancias_real).sum())
-            clientes_mas_cerca_real = numero_clientes - clientes_mas_cerca_consultado
-            
-            # Mejora/empeoramiento
-            mejora_distancia = distancia_promedio_real - distancia_promedio
-            mejora_porcentaje = (mejora_distancia / distancia_promedio_real * 100) if distancia_promedio_real > 0 else 0
-            ahorro_costo = costo_promedio_real - costo_promedio
-            
-            metricas_comparativas['sucursal_real'] = {
-                'lat': lat_real,
-                'lon': lon_real,
-                'distancia_promedio_actual': round(distancia_promedio_real, 2),
-                'costo_promedio_actual': round(costo_promedio_real, 2),
-                'distancia_consultado_a_real': round(float(dist_consultado_real), 2),
-                'clientes_mas_cerca_consultado': clientes_mas_cerca_consultado,
-                'clientes_mas_cerca_real': clientes_mas_cerca_real,
-                'porcentaje_mejora_consultado': round((clientes_mas_cerca_consultado / numero_clientes * 100), 1),
-                'mejora_distancia_km': round(mejora_distancia, 2),
-                'mejora_porcentaje': round(mejora_porcentaje, 1),
-                'ahorro_costo_promedio': round(ahorro_costo, 2)
-            }
-    
-    # Obtener coordenadas del óptimo sugerido
-    lat_optimo, lon_optimo = calcular_punto_optimo_sucursal(sucursal)
+    # Comparación con sucursal real
+    if lat_real is not None:
+        # Distancias de clientes a sucursal real
+        distancias_real = distancias[1]
+        distancia_promedio_real = float(distancias_real.mean(dtype=np.float64))
+        costo_promedio_real = distancia_promedio_real * costo_km
+        
+        # Distancia entre punto consultado y sucursal real
+        dist_consultado_real = haversine_km(lat_click, lon_click, lat_real, lon_real)
+        
+        # Clientes más cercanos a cada ubicación
+        clientes_mas_cerca_consultado = count_less(distancias_km, distancias_real)
+        clientes_mas_cerca_real = numero_clientes - clientes_mas_cerca_consultado
+        
+        # Mejora/empeoramiento
+        mejora_distancia = distancia_promedio_real - distancia_promedio
+        mejora_porcentaje = (mejora_distancia / distancia_promedio_real * 100) if distancia_promedio_real > 0 else 0
+        ahorro_costo = costo_promedio_real - costo_promedio
+        
+        metricas_comparativas['sucursal_real'] = {
+            'lat': lat_real,
+            'lon': lon_real,
+            'distancia_promedio_actual': round(distancia_promedio_real, 2),
+            'costo_promedio_actual': round(costo_promedio_real, 2),
+            'distancia_consultado_a_real': round(float(dist_consultado_real), 2),
+            'clientes_mas_cerca_consultado': clientes_mas_cerca_consultado,
+            'clientes_mas_cerca_real': clientes_mas_cerca_real,
+            'porcentaje_mejora_consultado': round((clientes_mas_cerca_consultado / numero_clientes * 100), 1),
+            'mejora_distancia_km': round(mejora_distancia, 2),
+            'mejora_porcentaje': round(mejora_porcentaje, 1),
+            'ahorro_costo_promedio': round(ahorro_costo, 2)
+        }
+    
+    # Comparación con óptimo sugerido
     if lat_optimo is not None:
-        # Calcular distancias de clientes al óptimo
-        distancias_optimo = calculate_distance_km(
-            clientes_filtrados, lat_optimo, lon_optimo, mode="haversine"
-        )
-        distancia_promedio_optimo = float(distancias_optimo.mean())
+        # Distancias de clientes al óptimo (última fila)
+        distancias_optimo = distancias[-1]
+        distancia_promedio_optimo = float(distancias_optimo.mean(dtype=np.float64))
         costo_promedio_optimo = distancia_promedio_optimo * costo_km
         
         # Distancia entre punto consultado y óptimo
-        from services.distance import haversine_km
         dist_consultado_optimo = haversine_km(lat_click, lon_click, lat_optimo, lon_optimo)
         
         # Comparación consultado vs óptimo
         # Si distancia_promedio > distancia_promedio_optimo → peor (diferencia positiva)
         # Si distancia_promedio < distancia_promedio_optimo → mejor (diferencia negativa)
-        clientes_mas_cerca_consultado_vs_optimo = int((distancias_km < distancias_optimo).sum())
+        clientes_mas_cerca_consultado_vs_optimo = count_less(distancias_km, distancias_optimo)
         diferencia_vs_optimo = distancia_promedio - distancia_promedio_optimo
         diferencia_porcentaje_vs_optimo = (diferencia_vs_optimo / distancia_promedio_optimo * 100) if distancia_promedio_optimo > 0 else 0
         
@@ -482,17 +602,16 @@ def api_analisis_punto():
             dist_optimo_real = haversine_km(lat_optimo, lon_optimo, lat_real, lon_real)
             metricas_comparativas['distancia_optimo_a_real'] = round(float(dist_optimo_real), 2)
     
-    # Generar tabla detallada
-    detalle_clientes = clientes_filtrados[[
-        'Cod Local', 'Local', 'Sucursal', 
-        'Zona Reparto', 'lat', 'lon', 
-        'distancia_km', 'costo_estimado'
-    ]].to_dict('records')
-    
-    # Redondear valores para presentación
-    for cliente in detalle_clientes:
-        cliente['distancia_km'] = round(cliente['distancia_km'], 2)
-        cliente['costo_estimado'] = round(cliente['costo_estimado'], 2)
+    # Generar tabla detallada directamente desde las columnas del índice,
+    # con distancias y costos ya redondeados para presentación
+    # (en float64: los costos pueden superar la precisión de float32)
+    distancias_km_64 = distancias_km.astype(np.float64)
+    columnas = COLUMNAS_CLIENTE + ['distancia_km', 'costo_estimado']
+    valores = [meta[col].tolist() for col in COLUMNAS_CLIENTE] + [
+        np.round(distancias_km_64, 2).tolist(),
+        np.round(distancias_km_64 * costo_km, 2).tolist(),
+    ]
+    detalle_clientes = [dict(zip(columnas, fila)) for fila in zip(*valores)]
     
     # Preparar respuesta
     response = {
@@ -512,6 +631,72 @@ def api_analisis_punto():
     return jsonify(response)
 
 
+@app.route('/api/clientes_en_radio')
+def api_clientes_en_radio():
+    """
+    Endpoint GET que devuelve los clientes de una sucursal ubicados a menos
+    de r_km kilómetros de un punto, ordenados del más cercano al más lejano.
+    Query params: sucursal, lat, lon, r_km
+    Retorna: JSON con lista de clientes y su distancia al punto.
+    """
+    sucursal = request.args.get('sucursal', '')
+    lat_str = request.args.get('lat', '')
+    lon_str = request.args.get('lon', '')
+    r_km_str = request.args.get('r_km', '')
+    
+    # Validar parámetros
+    if not all([sucursal, lat_str, lon_str, r_km_str]):
+        return jsonify({'error': 'Parámetros incompletos'}), 400
+    
+    try:
+        lat = float(lat_str)
+        lon = float(lon_str)
+        r_km = float(r_km_str)
+    except ValueError:
+        return jsonify({'error': 'Valores numéricos inválidos'}), 400
+    # float() acepta 'nan' e 'inf', que no son coordenadas ni radios válidos
+    if not all(math.isfinite(v) for v in (lat, lon, r_km)):
+        return jsonify({'error': 'Valores numéricos inválidos'}), 400
+    if r_km <= 0:
+        return jsonify({'error': 'El radio debe ser positivo'}), 400
+    
+    # El registro se toma una sola vez: los índices del KD-tree siempre
+    # corresponden a las coordenadas y columnas de la misma carga
+    registro = INDICE_SUCURSALES.get(sucursal)
+    if registro is None or len(registro.meta) == 0:
+        return jsonify({'error': 'No hay clientes para esta sucursal'}), 404
+    meta, lat_suc, lon_suc = registro.meta, registro.lat, registro.lon
+    
+    # Candidatos desde el KD-tree (O(log N + k)); sin scipy se revisan todos
+    # La cuerda es monótona en la distancia sobre la esfera: con una holgura
+    # mínima por redondeo, el resultado incluye a todos los clientes del radio
+    tree = registro.tree
+    if tree is not None:
+        idx = np.asarray(
+            tree.query_ball_point(coordenadas_esfera(lat, lon), r=radio_cuerda(r_km) * (1 + 1e-6)),
+            dtype=np.intp,
+        )
+    else:
+        idx = np.arange(len(lat_suc))
+    
+    # Filtro exacto con Haversine sobre los candidatos (en float64: son
+    # pocos y así el borde del radio no depende del redondeo en float32)
+    distancias = haversine_km(lat_suc[idx].astype(np.float64), lon_suc[idx].astype(np.float64), lat, lon)
+    dentro = distancias <= r_km
+    idx = idx[dentro]
+    distancias = distancias[dentro]
+    orden = np.argsort(distancias)
+    
+    clientes = meta.iloc[idx[orden]].assign(
+        distancia_km=np.round(distancias[orden].astype(np.float64), 2)
+    ).to_dict('records')
+    
+    return jsonify({
+        'clientes': clientes,
+        'total': len(clientes)
+    })
+
+
 @app.route('/export_detalle_csv')
 def export_detalle_csv():
     """
@@ -535,42 +720,37 @@ def export_detalle_csv():
     except ValueError:
         return "Valores numéricos inválidos", 400
     
-    # Filtrar clientes por sucursal
-    clientes_filtrados = clientes_df[
-        clientes_df['Sucursal'] == sucursal
-    ].copy()
+    # Clientes de la sucursal desde el índice precalculado (sin copiar)
+    registro = INDICE_SUCURSALES.get(sucursal)
     
-    if len(clientes_filtrados) == 0:
+    if registro is None or len(registro.meta) == 0:
         return "No hay clientes para esta sucursal", 404
+    meta = registro.meta
     
-    # Calcular distancias (modo haversine)
+    # Calcular distancias (modo haversine) por la interfaz unificada, con la
+    # trigonometría precalculada de la sucursal
     distancias_km = calculate_distance_km(
-        clientes_filtrados, 
-        lat_click, 
-        lon_click, 
-        mode="haversine"
-    )
-    
-    # Agregar distancias y costos
-    clientes_filtrados['distancia_km'] = distancias_km.round(2)
-    clientes_filtrados['costo_estimado'] = (distancias_km * costo_km).round(2)
-    
-    # Seleccionar columnas para exportar
-    df_export = clientes_filtrados[[
-        'Cod Local', 'Local', 'Sucursal', 
-        'Zona Reparto', 'lat', 'lon', 
-        'distancia_km', 'costo_estimado'
-    ]]
-    
-    # Convertir a CSV
-    output = StringIO()
-    df_export.to_csv(output, index=False, encoding='utf-8-sig')
-    output.seek(0)
+        meta, lat_click, lon_click, mode="haversine", precomputed=registro.trig
+    ).astype(np.float64)
+    
+    # Armar el DataFrame a exportar sobre las columnas existentes, agregando
+    # distancias y costos
+    columnas_export = {col: meta[col] for col in COLUMNAS_CLIENTE}
+    columnas_export['distancia_km'] = pd.Series(np.round(distancias_km, 2), index=meta.index)
+    columnas_export['costo_estimado'] = pd.Series(np.round(distancias_km * costo_km, 2), index=meta.index)
+    df_export = pd.DataFrame(columnas_export, copy=False)
+    
+    # Generar el CSV por bloques: la descarga comienza con el primer bloque
+    # y nunca se mantiene el archivo completo en memoria
+    def generate():
+        yield df_export.iloc[:0].to_csv(index=False)
+        for inicio in range(0, len(df_export), FILAS_POR_BLOQUE_CSV):
+            bloque = df_export.iloc[inicio:inicio + FILAS_POR_BLOQUE_CSV]
+            yield bloque.to_csv(index=False, header=False)
     
     # Crear respuesta con el CSV
-    from flask import Response
     return Response(
-        output.getvalue(),
+        stream_with_context(generate()),
         mimetype='text/csv',
         headers={
             'Content-Disposition': f'attachment; filename=detalle_analisis_{sucursal}.csv'
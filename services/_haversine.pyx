@@ -0,0 +1,50 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args = -fopenmp
+# distutils: extra_link_args = -fopenmp
+"""
+Kernel Haversine compilado con Cython (opcional).
+
+Alternativa a Numba sin compilación en tiempo de ejecución: el ciclo se
+compila de antemano a C y corre sin el GIL. services/distance.py lo usa si
+el módulo está compilado; si no, sigue con Numba o NumPy.
+
+Compilar en el lugar con:
+    cythonize -i services/_haversine.pyx
+Las directivas distutils de arriba compilan con OpenMP, así que el prange
+reparte el ciclo entre todos los núcleos (sin OpenMP correría en serie y
+sería más lento que el kernel Numba).
+"""
+
+from cython.parallel import prange
+
+cdef extern from "math.h" nogil:
+    double sin(double x)
+    double cos(double x)
+    double asin(double x)
+    double sqrt(double x)
+
+# Mismo valor que services.distance.R_TIERRA_KM
+cdef double R_TIERRA_KM = 6371.0
+cdef double DEG2RAD = 3.14159265358979323846 / 180.0
+
+
+def haversine_c(const double[::1] lat1, const double[::1] lon1,
+                double lat2, double lon2, double[::1] out):
+    """
+    Escribe en out la distancia Haversine (km) de cada punto (lat1[i],
+    lon1[i]) al destino escalar (lat2, lon2). Arrays float64 contiguos.
+    """
+    cdef Py_ssize_t i, n = lat1.shape[0]
+    cdef double lat1_r, s_dlat, s_dlon, a
+    cdef double lat2_r = lat2 * DEG2RAD
+    cdef double lon2_r = lon2 * DEG2RAD
+    cdef double cos_lat2 = cos(lat2_r)
+
+    for i in prange(n, nogil=True):
+        lat1_r = lat1[i] * DEG2RAD
+        s_dlat = sin((lat2_r - lat1_r) * 0.5)
+        s_dlon = sin((lon2_r - lon1[i] * DEG2RAD) * 0.5)
+        a = s_dlat * s_dlat + cos(lat1_r) * cos_lat2 * s_dlon * s_dlon
+        if a > 1.0:
+            a = 1.0
+        out[i] = 2.0 * R_TIERRA_KM * asin(sqrt(a))
@@ -1,16 +1,222 @@
 """
 Módulo de cálculo de distancias entre puntos geográficos.
 
-Implementación actual: Haversine (distancia a vuelo de pájaro)
-Diseño preparado para futuro: OSRM (distancia de ruteo real por carretera)
+Métodos disponibles: Haversine (distancia a vuelo de pájaro) y OSRM
+(distancia de ruteo real por carretera, requiere un servidor OSRM)
 
 La función principal calculate_distance_km() actúa como interfaz unificada
 que permite cambiar entre diferentes métodos de cálculo sin afectar el resto
 de la aplicación.
 """
 
+import json
+import logging
+import math
+import threading
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
 import numpy as np
-import pandas as pd
+
+try:
+    from numba import njit, prange
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+
+try:
+    # Extensión Cython opcional (ver services/_haversine.pyx)
+    from services._haversine import haversine_c
+    CYTHON_DISPONIBLE = True
+except ImportError:
+    CYTHON_DISPONIBLE = False
+
+try:
+    # CuPy opcional: matrices de distancias en GPU (haversine_cdist_gpu)
+    import cupy as cp
+    CUPY_DISPONIBLE = True
+except ImportError:
+    CUPY_DISPONIBLE = False
+
+try:
+    import numexpr as ne
+    NUMEXPR_DISPONIBLE = True
+except ImportError:
+    NUMEXPR_DISPONIBLE = False
+
+logger = logging.getLogger(__name__)
+
+# Factor de conversión de grados a radianes (y su versión float32, para no
+# promover a float64 los arrays float32)
+_DEG2RAD = np.float64(np.pi / 180.0)
+_DEG2RAD_F32 = np.float32(np.pi / 180.0)
+
+# Radio medio de la Tierra en kilómetros, común a todos los caminos de cálculo
+# (el kernel Cython de services/_haversine.pyx usa el mismo valor)
+R_TIERRA_KM = 6371.0
+
+
+# OSRM: el servicio table acepta por defecto hasta 100 coordenadas por
+# petición (max-table-size); cada lote lleva el destino más 99 clientes
+OSRM_MAX_COORDENADAS = 100
+OSRM_TIMEOUT_S = 10
+
+# Los kernels con prange se ejecutan de a uno: la capa de hilos 'workqueue'
+# de Numba (la que se usa si no hay TBB ni OpenMP) aborta el proceso si dos
+# hilos de peticiones entran a la vez. Cada kernel ya ocupa todos los núcleos,
+# así que serializarlos no resta rendimiento
+_LOCK_PRANGE = threading.Lock()
+
+# Desde este largo haversine_km usa el kernel Numba (o numexpr si no hay
+# Numba); con pocos puntos el costo de entrar al código compilado no se
+# alcanza a recuperar
+UMBRAL_KERNEL_HAVERSINE = 4096
+
+
+if NUMBA_DISPONIBLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_kernel(lat1, lon1, lat2_s, lon2_s, out):
+        """
+        Haversine de cada punto (lat1[i], lon1[i]) a un destino escalar,
+        escrito en out. Todo el cálculo de un punto se hace en una sola
+        pasada, sin arrays intermedios.
+        
+        Las constantes se convierten al tipo de lat1, así que con float32 el
+        ciclo completo opera en float32 (el doble de elementos por registro
+        SIMD y sinf/cosf en vez de sin/cos) en lugar de promover a float64.
+        """
+        tipo = lat1.dtype.type
+        d2r = tipo(_DEG2RAD)
+        medio = tipo(0.5)
+        uno = tipo(1.0)
+        dos_r = tipo(2.0 * R_TIERRA_KM)
+        # Términos del destino en float64 y luego al tipo de trabajo
+        lat2_r = tipo(lat2_s * _DEG2RAD)
+        lon2_r = tipo(lon2_s * _DEG2RAD)
+        cos_lat2 = tipo(math.cos(lat2_s * _DEG2RAD))
+        for i in prange(lat1.shape[0]):
+            lat1_r = lat1[i] * d2r
+            dlat = lat2_r - lat1_r
+            dlon = lon2_r - lon1[i] * d2r
+            s_dlat = math.sin(dlat * medio)
+            s_dlon = math.sin(dlon * medio)
+            a = s_dlat * s_dlat + math.cos(lat1_r) * cos_lat2 * s_dlon * s_dlon
+            out[i] = dos_r * math.asin(math.sqrt(min(a, uno)))
+
+    # Compilar al importar el módulo (float64 y float32) para no pagar el
+    # costo en la primera petición
+    _haversine_kernel(np.zeros(1), np.zeros(1), 0.0, 0.0, np.empty(1))
+    _haversine_kernel(np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32),
+                      0.0, 0.0, np.empty(1, dtype=np.float32))
+
+
+def make_haversine_for_dest(lat_dest, lon_dest):
+    """
+    Crea una función de distancia Haversine especializada para un destino fijo.
+    
+    Para evaluar muchos conjuntos de clientes contra el mismo destino. Los
+    términos del destino (radianes y coseno) se calculan una vez y, con
+    Numba, quedan como constantes dentro del kernel compilado. Compilar cuesta
+    del orden de décimas de segundo por destino, así que conviene sólo si la
+    función se reutiliza muchas veces.
+    
+    Parámetros:
+        lat_dest, lon_dest: Coordenadas del destino
+    
+    Retorna:
+        Función f(lat, lon) -> array NumPy con distancias en kilómetros, del
+        mismo tipo que la entrada (float32 o float64)
+    """
+    if not NUMBA_DISPONIBLE:
+        return lambda lat, lon: haversine_km(lat, lon, lat_dest, lon_dest)
+    
+    lat2_r = float(lat_dest) * _DEG2RAD
+    lon2_r = float(lon_dest) * _DEG2RAD
+    cos_lat2 = math.cos(lat2_r)
+    
+    @njit(parallel=True, fastmath=True)
+    def _kernel(lat1, lon1, out):
+        # lat2_r, lon2_r y cos_lat2 son constantes para Numba
+        tipo = lat1.dtype.type
+        d2r = tipo(_DEG2RAD)
+        medio = tipo(0.5)
+        dos_r = tipo(2.0 * R_TIERRA_KM)
+        for i in prange(lat1.shape[0]):
+            lat1_r = lat1[i] * d2r
+            s_dlat = math.sin((tipo(lat2_r) - lat1_r) * medio)
+            s_dlon = math.sin((tipo(lon2_r) - lon1[i] * d2r) * medio)
+            a = s_dlat * s_dlat + math.cos(lat1_r) * tipo(cos_lat2) * s_dlon * s_dlon
+            out[i] = dos_r * math.asin(math.sqrt(min(a, tipo(1.0))))
+    
+    def haversine_dest(lat, lon):
+        lat = np.asarray(lat).ravel()
+        lon = np.asarray(lon).ravel()
+        dtype = np.result_type(lat, lon, np.float32)
+        lat = np.ascontiguousarray(lat, dtype=dtype)
+        lon = np.ascontiguousarray(lon, dtype=dtype)
+        out = np.empty(lat.shape[0], dtype=dtype)
+        with _LOCK_PRANGE:
+            _kernel(lat, lon, out)
+        return out
+    
+    return haversine_dest
+
+
+def _haversine_a(lat1, lon1, lat2, lon2):
+    """
+    Término 'a' de la fórmula Haversine, calculado con NumPy en buffers
+    propios (lat1 y lon1 deben ser arrays NumPy). Retorna un array que el
+    llamador puede modificar en el lugar.
+    """
+    # Buffers de trabajo: todo el cálculo se hace en ellos con out=, sin
+    # crear un array temporal por cada operación
+    # Con arrays se respeta float32; un punto escalar se calcula en float64
+    # (NumPy 1.26 convierte los arrays 0-d por valor y daría float32)
+    minimo = np.float64 if lat1.ndim == 0 else np.float32
+    dtype = np.result_type(lat1, lon1, lat2, lon2, minimo)
+    shape = np.broadcast_shapes(lat1.shape, lon1.shape, np.shape(lat2), np.shape(lon2))
+    dlat = np.empty(shape, dtype=dtype)
+    dlon = np.empty(shape, dtype=dtype)
+    cos_lat = np.empty(shape, dtype=dtype)
+    
+    # Diferencias en radianes
+    np.subtract(lat2, lat1, out=dlat)
+    dlat *= _DEG2RAD
+    np.subtract(lon2, lon1, out=dlon)
+    dlon *= _DEG2RAD
+    
+    # cos(lat1) * cos(lat2)
+    np.multiply(lat1, _DEG2RAD, out=cos_lat)
+    np.cos(cos_lat, out=cos_lat)
+    if np.ndim(lat2) == 0:
+        # Destino escalar: cos(lat2) como float de Python, sin pasar por ufuncs
+        cos_lat *= math.cos(lat2 * _DEG2RAD)
+    else:
+        cos_lat *= np.cos(np.multiply(lat2, _DEG2RAD))
+    
+    # Fórmula Haversine: a = sin²(dlat/2) + cos(lat1)·cos(lat2)·sin²(dlon/2)
+    if dtype == np.float64:
+        # sin²(x/2) = (1 - cos(x))/2: una pasada menos sobre los arrays.
+        # Sólo en float64; en float32 1 - cos(x) pierde todos los dígitos
+        # para clientes a pocos kilómetros
+        np.cos(dlat, out=dlat)
+        np.subtract(1.0, dlat, out=dlat)
+        np.cos(dlon, out=dlon)
+        np.subtract(1.0, dlon, out=dlon)
+        dlon *= cos_lat
+        dlat += dlon
+        dlat *= 0.5
+    else:
+        dlat *= 0.5
+        np.sin(dlat, out=dlat)
+        np.square(dlat, out=dlat)
+        dlon *= 0.5
+        np.sin(dlon, out=dlon)
+        np.square(dlon, out=dlon)
+        dlon *= cos_lat
+        dlat += dlon
+    
+    return dlat
 
 
 def haversine_km(lat1, lon1, lat2, lon2):
@@ -28,38 +234,379 @@ def haversine_km(lat1, lon1, lat2, lon2):
         Distancia en kilómetros (array o escalar, según entrada)
     
     Nota: Esta función está vectorizada con numpy para calcular eficientemente
-    distancias de múltiples puntos simultáneamente.
+    distancias de múltiples puntos simultáneamente. Con arrays float32 el
+    resultado también es float32: el error es < 1 m para clientes a escala
+    de una sucursal (hasta unos 400 km del destino) y crece con la distancia
+    (~1,3 m entre extremos de Chile).
+    """
+    lat1 = np.asarray(lat1)
+    lon1 = np.asarray(lon1)
+    
+    # Un solo punto: con math es mucho más rápido que pasar por los ufuncs
+    if (lat1.size == 1 and lon1.size == 1 and lat1.ndim <= 1 and lon1.ndim <= 1
+            and np.ndim(lat2) == 0 and np.ndim(lon2) == 0):
+        lat1_r = float(lat1.flat[0]) * _DEG2RAD
+        lat2_r = float(lat2) * _DEG2RAD
+        s_dlat = math.sin((lat2_r - lat1_r) * 0.5)
+        s_dlon = math.sin((float(lon2) - float(lon1.flat[0])) * _DEG2RAD * 0.5)
+        a = s_dlat * s_dlat + math.cos(lat1_r) * math.cos(lat2_r) * s_dlon * s_dlon
+        distancia = 2.0 * R_TIERRA_KM * math.asin(math.sqrt(min(a, 1.0)))
+        if lat1.ndim == 0:
+            return distancia
+        # Array de largo 1: se mantiene un array del tipo de la entrada
+        return np.array([distancia], dtype=np.result_type(lat1, lon1, np.float32))
+    
+    # Arrays float64 grandes contra un destino escalar: extensión Cython
+    # compilada, si está disponible
+    if (CYTHON_DISPONIBLE and lat1.ndim == 1 and lat1.shape == lon1.shape
+            and lat1.size >= UMBRAL_KERNEL_HAVERSINE
+            and np.ndim(lat2) == 0 and np.ndim(lon2) == 0
+            and np.result_type(lat1, lon1, np.float32) == np.float64):
+        lat1 = np.ascontiguousarray(lat1, dtype=np.float64)
+        lon1 = np.ascontiguousarray(lon1, dtype=np.float64)
+        out = np.empty(lat1.shape[0])
+        haversine_c(lat1, lon1, float(lat2), float(lon2), out)
+        return out
+    
+    # Arrays grandes contra un destino escalar: kernel Numba de una pasada
+    if (NUMBA_DISPONIBLE and lat1.ndim == 1 and lat1.shape == lon1.shape
+            and lat1.size >= UMBRAL_KERNEL_HAVERSINE
+            and np.ndim(lat2) == 0 and np.ndim(lon2) == 0):
+        dtype = np.result_type(lat1, lon1, np.float32)
+        lat1 = np.ascontiguousarray(lat1, dtype=dtype)
+        lon1 = np.ascontiguousarray(lon1, dtype=dtype)
+        out = np.empty(lat1.shape[0], dtype=dtype)
+        with _LOCK_PRANGE:
+            _haversine_kernel(lat1, lon1, float(lat2), float(lon2), out)
+        return out
+    
+    # Sin Numba: numexpr evalúa la fórmula completa en una pasada por bloques
+    if (not NUMBA_DISPONIBLE and NUMEXPR_DISPONIBLE
+            and lat1.size >= UMBRAL_KERNEL_HAVERSINE
+            and np.ndim(lat2) == 0 and np.ndim(lon2) == 0):
+        # Constantes en el mismo tipo que los arrays para no promover float32
+        tipo = np.result_type(lat1, lon1, np.float32).type
+        d2r = _DEG2RAD_F32 if tipo == np.float32 else _DEG2RAD
+        # a se acota a 1 antes del arcoseno, igual que en los demás caminos
+        a = ("(sin((lat2 - lat1) * h)**2"
+             " + cos_lat2 * cos(lat1 * d) * sin((lon2 - lon1) * h)**2)")
+        return ne.evaluate(
+            f"k * arcsin(sqrt(where({a} > uno, uno, {a})))",
+            local_dict={
+                'lat1': lat1, 'lon1': lon1,
+                'lat2': tipo(lat2), 'lon2': tipo(lon2),
+                'cos_lat2': tipo(math.cos(lat2 * _DEG2RAD)),
+                'd': d2r, 'h': tipo(d2r * 0.5), 'k': tipo(2.0 * R_TIERRA_KM), 'uno': tipo(1.0),
+            },
+        )
+    
+    a = _haversine_a(lat1, lon1, lat2, lon2)
+    
+    # Con entradas escalares se retorna un escalar y no un array 0-d
+    return _km_desde_a(a)[()]
+
+
+def _km_desde_a(a):
+    """
+    Convierte en el lugar el término a de Haversine en distancia en
+    kilómetros y retorna el mismo array: 2R·asin(√a), equivalente a
+    2R·atan2(√a, √(1-a)) para a en [0, 1]. Por redondeo a puede pasar de 1
+    en puntos casi antípodas (arcsin daría NaN), así que se acota.
     """
-    # Radio de la Tierra en kilómetros
-    R = 6371.0
+    np.minimum(a, 1.0, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    a *= 2.0 * R_TIERRA_KM
+    return a
+
+
+def haversine_rank_score(lat_array, lon_array, lat_dest, lon_dest):
+    """
+    Puntaje para ordenar puntos por cercanía a un destino sin calcular la
+    distancia en kilómetros.
+    
+    Retorna el término a = sin²(dlat/2) + cos(lat1)·cos(lat2)·sin²(dlon/2) de
+    Haversine, que crece con la distancia (la distancia es 2R·asin(√a)), así
+    que preserva el orden: argmin/argsort del puntaje coinciden con los de la
+    distancia. Se ahorra la raíz y el arcoseno por punto; la distancia en km
+    se calcula después sólo para los puntos que se muestran.
+    
+    Parámetros:
+        lat_array, lon_array: Arrays con las coordenadas de los puntos
+        lat_dest, lon_dest: Coordenadas del destino
+    
+    Retorna:
+        Array NumPy (sin unidades) con el puntaje de cada punto
+    """
+    return _haversine_a(np.asarray(lat_array), np.asarray(lon_array), lat_dest, lon_dest)[()]
+
+
+def precompute_trig(lat, lon):
+    """
+    Precalcula los términos de Haversine que dependen sólo de los puntos de
+    origen, para reutilizarlos en cálculos contra distintos destinos.
+    
+    Parámetros:
+        lat, lon: Arrays con latitud y longitud en grados
+    
+    Retorna:
+        Tupla (lat_rad, lon_rad, cos_lat_rad)
+    """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+    deg2rad = _DEG2RAD_F32 if lat.dtype == np.float32 else _DEG2RAD
+    lat_rad = lat * deg2rad
+    lon_rad = lon * deg2rad
+    return lat_rad, lon_rad, np.cos(lat_rad)
+
+
+def haversine_multi(lat, lon, refs, precomputed=None):
+    """
+    Calcula en una sola pasada la distancia Haversine de N puntos a K puntos
+    de referencia.
+    
+    La conversión a radianes y el coseno de las latitudes de los N puntos se
+    calculan una sola vez y se reutilizan para todas las referencias.
+    
+    Parámetros:
+        lat, lon: Arrays con latitud y longitud de los N puntos
+        refs: Secuencia de K tuplas (lat, lon) de referencia
+        precomputed: Tupla opcional (lat_rad, lon_rad, cos_lat_rad) de
+                     precompute_trig(); si se entrega, lat y lon se ignoran
+    
+    Retorna:
+        Array de forma (K, N) con distancias en kilómetros, en float32 si
+        las coordenadas de entrada son float32
+    """
+    if precomputed is None:
+        precomputed = precompute_trig(lat, lon)
+    lat_rad, lon_rad, cos_lat = precomputed
     
-    # Convertir grados a radianes
-    lat1_rad = np.radians(lat1)
-    lon1_rad = np.radians(lon1)
-    lat2_rad = np.radians(lat2)
-    lon2_rad = np.radians(lon2)
+    # Referencias como columna (K, 1) para broadcasting contra (N,), en la
+    # misma precisión que los puntos para no promover todo a float64. Cada
+    # referencia se parte en alto + bajo (ref ≈ hi + lo): con float32 el
+    # redondeo de la referencia por sí solo ya costaría ~0.4 m
+    dtype = np.result_type(lat_rad, np.float32)
+    refs_rad = np.asarray(refs, dtype=np.float64).reshape(-1, 2) * _DEG2RAD
+    refs_hi = refs_rad.astype(dtype)
+    refs_lo = (refs_rad - refs_hi).astype(dtype)
+    cos_ref = np.cos(refs_rad[:, 0:1]).astype(dtype)
     
-    # Diferencias
-    dlat = lat2_rad - lat1_rad
-    dlon = lon2_rad - lon1_rad
+    dlat = (refs_hi[:, 0:1] - lat_rad) + refs_lo[:, 0:1]
+    dlon = (refs_hi[:, 1:2] - lon_rad) + refs_lo[:, 1:2]
+    a = np.sin(dlat / 2)**2 + cos_ref * cos_lat * np.sin(dlon / 2)**2
+    return _km_desde_a(a)
+
+
+if NUMBA_DISPONIBLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_cdist_kernel(lat1_r, lon1_r, cos1, lat2_r, lon2_r, cos2, out):
+        """
+        Matriz (N, M) de distancias Haversine a partir de radianes y cosenos
+        ya calculados. Cada hilo toma filas completas (un punto de origen
+        contra todos los destinos).
+        """
+        m = lat2_r.shape[0]
+        for i in prange(lat1_r.shape[0]):
+            for j in range(m):
+                s_dlat = math.sin((lat2_r[j] - lat1_r[i]) * 0.5)
+                s_dlon = math.sin((lon2_r[j] - lon1_r[i]) * 0.5)
+                a = s_dlat * s_dlat + cos1[i] * cos2[j] * s_dlon * s_dlon
+                out[i, j] = 2.0 * R_TIERRA_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+    # Compilar al importar el módulo (float64 y float32)
+    _haversine_cdist_kernel(*[np.zeros(1)] * 6, np.empty((1, 1)))
+    _haversine_cdist_kernel(*[np.zeros(1, dtype=np.float32)] * 6,
+                            np.empty((1, 1), dtype=np.float32))
+
+
+def haversine_cdist(lat1, lon1, lat2, lon2, use_gpu=False):
+    """
+    Calcula la matriz de distancias Haversine entre N puntos de origen (p. ej.
+    clientes) y M puntos de destino (p. ej. candidatos a sucursal), al estilo
+    de scipy.spatial.distance.cdist.
+    
+    Radianes y cosenos se calculan una sola vez por punto, no una vez por par.
+    
+    Parámetros:
+        lat1, lon1: Arrays de largo N con los puntos de origen
+        lat2, lon2: Arrays de largo M con los puntos de destino
+        use_gpu: Calcular en GPU con CuPy (haversine_cdist_gpu); si CuPy no
+                 está instalado se calcula en CPU
+    
+    Retorna:
+        Array de forma (N, M) con distancias en kilómetros, en float32 si
+        todas las coordenadas son float32
+    """
+    if use_gpu and CUPY_DISPONIBLE:
+        return haversine_cdist_gpu(lat1, lon1, lat2, lon2)
     
-    # Fórmula Haversine
-    a = np.sin(dlat / 2)**2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(dlon / 2)**2
-    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    lat1 = np.asarray(lat1).ravel()
+    lon1 = np.asarray(lon1).ravel()
+    lat2 = np.asarray(lat2).ravel()
+    lon2 = np.asarray(lon2).ravel()
+    dtype = np.result_type(lat1, lon1, lat2, lon2, np.float32)
     
-    # Distancia en kilómetros
-    distance = R * c
+    lat1_r, lon1_r, cos1 = precompute_trig(lat1.astype(dtype, copy=False), lon1.astype(dtype, copy=False))
+    lat2_r, lon2_r, cos2 = precompute_trig(lat2.astype(dtype, copy=False), lon2.astype(dtype, copy=False))
     
-    return distance
+    if NUMBA_DISPONIBLE and lat1.size * lat2.size >= UMBRAL_KERNEL_HAVERSINE:
+        out = np.empty((lat1.size, lat2.size), dtype=dtype)
+        with _LOCK_PRANGE:
+            _haversine_cdist_kernel(lat1_r, lon1_r, cos1, lat2_r, lon2_r, cos2, out)
+        return out
+    
+    # Broadcasting (N, 1) contra (M,)
+    a = (np.sin((lat2_r - lat1_r[:, None]) / 2)**2 +
+         cos1[:, None] * cos2 * np.sin((lon2_r - lon1_r[:, None]) / 2)**2)
+    return _km_desde_a(a)
+
+
+if CUPY_DISPONIBLE:
+    # Fórmula completa en un solo kernel CUDA; T es float32 o float64 según
+    # las entradas. Los argumentos (N, 1) y (M,) se combinan por broadcasting
+    _haversine_gpu_kernel = cp.ElementwiseKernel(
+        'T lat1, T lon1, T cos1, T lat2, T lon2, T cos2',
+        'T d',
+        f"""
+        T s_dlat = sin((lat2 - lat1) * (T)0.5);
+        T s_dlon = sin((lon2 - lon1) * (T)0.5);
+        T a = s_dlat * s_dlat + cos1 * cos2 * s_dlon * s_dlon;
+        d = (T)(2.0 * {R_TIERRA_KM!r}) * asin(sqrt(fmin(a, (T)1.0)));
+        """,
+        'haversine_cdist_gpu',
+    )
+
+
+def haversine_cdist_gpu(lat1, lon1, lat2, lon2):
+    """
+    Versión de haversine_cdist() en GPU con CuPy, para barridos grandes de
+    candidatos (N·M del orden de millones o más).
+    
+    Los arrays se copian a la GPU en formato SoA (lat y lon por separado) y
+    la matriz (N, M) se calcula en un solo kernel.
+    
+    Parámetros:
+        lat1, lon1: Arrays de largo N con los puntos de origen
+        lat2, lon2: Arrays de largo M con los puntos de destino
+    
+    Retorna:
+        Array NumPy de forma (N, M) con distancias en kilómetros
+    """
+    if not CUPY_DISPONIBLE:
+        raise RuntimeError("CuPy no está instalado; usar haversine_cdist()")
+    
+    lat1 = np.asarray(lat1).ravel()
+    lon1 = np.asarray(lon1).ravel()
+    lat2 = np.asarray(lat2).ravel()
+    lon2 = np.asarray(lon2).ravel()
+    dtype = np.result_type(lat1, lon1, lat2, lon2, np.float32)
+    
+    # Radianes y cosenos en la GPU, una vez por punto
+    d2r = _DEG2RAD_F32 if dtype == np.float32 else _DEG2RAD
+    lat1_r = cp.asarray(lat1, dtype=dtype) * d2r
+    lon1_r = cp.asarray(lon1, dtype=dtype) * d2r
+    lat2_r = cp.asarray(lat2, dtype=dtype) * d2r
+    lon2_r = cp.asarray(lon2, dtype=dtype) * d2r
+    
+    d = _haversine_gpu_kernel(
+        lat1_r[:, None], lon1_r[:, None], cp.cos(lat1_r)[:, None],
+        lat2_r, lon2_r, cp.cos(lat2_r),
+    )
+    return cp.asnumpy(d)
+
+
+if NUMBA_DISPONIBLE:
+    # Serial y sin GIL: se llama desde los hilos de las peticiones, y un
+    # kernel con prange no es seguro ahí con la capa de hilos 'workqueue'
+    # de Numba (la que se usa si no hay TBB ni OpenMP)
+    @njit(cache=True, nogil=True)
+    def _count_less_kernel(a, b):
+        s = 0
+        for i in range(a.size):
+            if a[i] < b[i]:
+                s += 1
+        return s
+
+    # Compilar al importar el módulo para no pagar el costo en la primera petición
+    _count_less_kernel(np.zeros(1, dtype=np.float32), np.ones(1, dtype=np.float32))
+
+
+def count_less(a, b):
+    """
+    Cuenta los elementos donde a[i] < b[i] (p. ej. clientes más cercanos a un
+    punto que a otro).
+    
+    Con Numba se recorre una sola vez sin crear el array booleano intermedio.
+    
+    Parámetros:
+        a, b: Arrays NumPy del mismo largo y tipo
+    
+    Retorna:
+        Cantidad de elementos como int de Python
+    """
+    if NUMBA_DISPONIBLE:
+        return int(_count_less_kernel(a, b))
+    return int(np.count_nonzero(a < b))
+
+
+def coordenadas_esfera(lat, lon):
+    """
+    Convierte coordenadas geográficas a puntos 3D sobre la esfera unitaria.
+    
+    La distancia euclidiana entre dos de estos puntos (la cuerda) crece con
+    la distancia Haversine, así que un KD-tree sobre ellos consultado con
+    radio_cuerda(r_km) devuelve exactamente los puntos a menos de r_km, sin
+    la distorsión de una proyección plana.
+    
+    Parámetros:
+        lat, lon: Latitud y longitud en grados (escalares o arrays)
+    
+    Retorna:
+        Array de forma (N, 3) en float64 (o (3,) para un punto)
+    """
+    lat_rad = np.asarray(lat, dtype=np.float64) * _DEG2RAD
+    lon_rad = np.asarray(lon, dtype=np.float64) * _DEG2RAD
+    cos_lat = np.cos(lat_rad)
+    return np.stack((cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)), axis=-1)
+
+
+def radio_cuerda(r_km):
+    """
+    Largo de la cuerda en la esfera unitaria que corresponde a una distancia
+    Haversine de r_km (para consultar un KD-tree de coordenadas_esfera()).
+    """
+    # Más allá de media circunferencia la cuerda ya es el diámetro
+    return 2.0 * math.sin(min(r_km / (2.0 * R_TIERRA_KM), math.pi / 2))
+
+
+def _coordenadas_clientes(clientes_df, dtype):
+    """
+    Columnas 'lat' y 'lon' de clientes_df como arrays NumPy contiguos del
+    tipo pedido. to_numpy(copy=False) no copia si la columna ya tiene ese
+    tipo; sólo se copia si la vista resultante no es contigua.
+    """
+    lat = clientes_df['lat'].to_numpy(dtype=dtype, copy=False)
+    lon = clientes_df['lon'].to_numpy(dtype=dtype, copy=False)
+    if not lat.flags.c_contiguous:
+        lat = np.ascontiguousarray(lat)
+    if not lon.flags.c_contiguous:
+        lon = np.ascontiguousarray(lon)
+    return lat, lon
 
 
 def osrm_route_distance_km(clientes_df, lat_dest, lon_dest, osrm_url="http://localhost:5000"):
     """
-    [FUTURO] Calcula distancias de ruteo reales usando un servidor OSRM.
+    Calcula distancias de ruteo reales usando un servidor OSRM.
     
     OSRM (Open Source Routing Machine) proporciona distancias de ruta por carretera,
     considerando la red vial real y no solo la distancia en línea recta.
     
+    Los clientes se envían en lotes al servicio 'table' (una petición por
+    lote, no una por cliente). Los clientes de un lote que falla, o sin ruta
+    encontrada, usan la distancia Haversine como respaldo, calculada en una
+    sola llamada vectorizada sólo para ellos.
+    
     Parámetros:
         clientes_df: DataFrame con columnas 'lat' y 'lon' de los clientes
         lat_dest: Latitud del punto destino (sucursal propuesta)
@@ -67,72 +614,155 @@ def osrm_route_distance_km(clientes_df, lat_dest, lon_dest, osrm_url="http://loc
         osrm_url: URL del servidor OSRM (por defecto localhost:5000)
     
     Retorna:
-        Serie de pandas con distancias en kilómetros
+        Array NumPy con distancias en kilómetros, en el orden de clientes_df
+    """
+    lat, lon = _coordenadas_clientes(clientes_df, np.float64)
+    n = lat.shape[0]
     
-    Implementación sugerida:
-    ----------------------
-    1. Construir request a OSRM API con múltiples coordenadas
-       Ejemplo: GET /route/v1/driving/{lon1},{lat1};{lon2},{lat2}
+    # NaN marca los clientes sin distancia OSRM
+    distancias = np.full(n, np.nan)
+    lote = OSRM_MAX_COORDENADAS - 1
+    for inicio in range(0, n, lote):
+        fin = min(inicio + lote, n)
+        puntos = np.column_stack((lat[inicio:fin], lon[inicio:fin]))
+        try:
+            distancias[inicio:fin] = batch_osrm_distances(
+                np.vstack((puntos, [(lat_dest, lon_dest)])), osrm_url
+            )
+        except HTTPError as e:
+            # El servidor respondió con error para este lote: seguir con el resto
+            logger.warning("OSRM falló para clientes %d-%d: %s", inicio, fin - 1, e)
+        except OSError as e:
+            # Servidor caído o sin respuesta (URLError, timeout): reintentar
+            # con cada lote sólo sumaría esperas; el resto va al respaldo
+            logger.warning("OSRM no disponible desde el cliente %d: %s", inicio, e)
+            break
+        except (ValueError, KeyError) as e:
+            logger.warning("OSRM falló para clientes %d-%d: %s", inicio, fin - 1, e)
     
-    2. Opciones de implementación:
-       a) Batch: Enviar todas las coordenadas en una sola petición (más eficiente)
-          - Requiere construir URL con múltiples puntos
-          - Limitar a 100-200 puntos por petición para evitar URLs muy largas
-          
-       b) Individual: Iterar sobre clientes y hacer una petición por cliente
-          - Más simple pero más lento
-          - Útil si hay pocos clientes
+    # Respaldo Haversine vectorizado, sólo para los que no tienen ruta
+    fallidos = np.isnan(distancias)
+    if fallidos.any():
+        distancias[fallidos] = haversine_km(lat[fallidos], lon[fallidos], lat_dest, lon_dest)
     
-    3. Parsear respuesta JSON de OSRM y extraer distancias
-       La respuesta típica incluye: routes[0].distance (en metros)
+    return distancias
+
+
+def calculate_distance_from_arrays(lat_array, lon_array, lat_dest, lon_dest):
+    """
+    Distancias Haversine desde arrays NumPy de coordenadas de clientes.
     
-    4. Convertir metros a kilómetros y retornar
+    Variante de calculate_distance_km() para quien ya tiene las coordenadas
+    como arrays (p. ej. el índice por sucursal): no pasa por pandas.
     
-    Ejemplo de código (comentado para implementación futura):
+    Parámetros:
+        lat_array, lon_array: Arrays NumPy con las coordenadas de los clientes
+        lat_dest, lon_dest: Coordenadas del punto destino (escalares)
     
-    import requests
+    Retorna:
+        Array NumPy con distancias en kilómetros, del mismo tipo que la entrada
+    """
+    return haversine_km(lat_array, lon_array, lat_dest, lon_dest)
+
+
+def build_client_cache(clientes_df, dtype="float32"):
+    """
+    Prepara las coordenadas de los clientes para calcular distancias contra
+    muchos destinos distintos (p. ej. al evaluar candidatos a sucursal).
     
-    distancias = []
-    for idx, row in clientes_df.iterrows():
-        lat_orig = row['lat']
-        lon_orig = row['lon']
-        
-        # Construir URL para OSRM
-        url = f"{osrm_url}/route/v1/driving/{lon_orig},{lat_orig};{lon_dest},{lat_dest}"
-        params = {
-            'overview': 'false',
-            'steps': 'false'
-        }
-        
-        try:
-            response = requests.get(url, params=params, timeout=5)
-            data = response.json()
-            
-            if data['code'] == 'Ok':
-                # Extraer distancia en metros y convertir a km
-                distance_m = data['routes'][0]['distance']
-                distance_km = distance_m / 1000.0
-                distancias.append(distance_km)
-            else:
-                # Si falla el ruteo, usar Haversine como fallback
-                dist_fallback = haversine_km(lat_orig, lon_orig, lat_dest, lon_dest)
-                distancias.append(dist_fallback)
-        except:
-            # En caso de error, usar Haversine como fallback
-            dist_fallback = haversine_km(lat_orig, lon_orig, lat_dest, lon_dest)
-            distancias.append(dist_fallback)
-    
-    return pd.Series(distancias, index=clientes_df.index)
-    """
-    
-    # Placeholder: Por ahora lanzar excepción indicando que no está implementado
-    raise NotImplementedError(
-        "OSRM routing no está implementado aún. "
-        "Descomentar y completar el código sugerido arriba para habilitar."
-    )
+    Los radianes y el coseno de la latitud dependen sólo de los clientes, así
+    que se calculan una vez aquí y no en cada llamada.
+    
+    Parámetros:
+        clientes_df: DataFrame con columnas 'lat' y 'lon' de los clientes
+        dtype: Tipo de los arrays del cache (float32 por defecto)
+    
+    Retorna:
+        Diccionario con 'lat_rad', 'lon_rad', 'cos_lat' (arrays NumPy) e
+        'index' (índice de clientes_df)
+    """
+    lat_rad, lon_rad, cos_lat = precompute_trig(*_coordenadas_clientes(clientes_df, dtype))
+    return {
+        'lat_rad': lat_rad,
+        'lon_rad': lon_rad,
+        'cos_lat': cos_lat,
+        'index': clientes_df.index,
+    }
 
 
-def calculate_distance_km(clientes_df, lat_dest, lon_dest, mode="haversine"):
+def calculate_distance_km_cached(cache, lat_dest, lon_dest):
+    """
+    Distancias Haversine desde los clientes de un cache de build_client_cache()
+    a un punto destino, sin recalcular radianes ni cos(lat) de los clientes.
+    
+    Retorna:
+        Array NumPy con distancias en kilómetros, en el orden de cache['index']
+    """
+    precomputed = (cache['lat_rad'], cache['lon_rad'], cache['cos_lat'])
+    return haversine_multi(None, None, [(lat_dest, lon_dest)], precomputed=precomputed)[0]
+
+
+def prepare_clientes(clientes_df, dtype="float32"):
+    """
+    Agrega a clientes_df las columnas 'lat_rad', 'lon_rad' y 'cos_lat_rad'
+    (radianes y coseno de la latitud), para que calculate_distance_km() las
+    use directamente en vez de recalcularlas en cada llamada.
+    
+    Contrato: las tres columnas deben corresponder a 'lat' y 'lon' de la misma
+    fila; si se modifican las coordenadas hay que volver a llamar a esta
+    función.
+    
+    Parámetros:
+        clientes_df: DataFrame con columnas 'lat' y 'lon' de los clientes
+        dtype: Tipo de las columnas agregadas (float32 por defecto)
+    
+    Retorna:
+        Nuevo DataFrame con las columnas agregadas (clientes_df no se modifica)
+    """
+    lat_rad, lon_rad, cos_lat = precompute_trig(*_coordenadas_clientes(clientes_df, dtype))
+    return clientes_df.assign(lat_rad=lat_rad, lon_rad=lon_rad, cos_lat_rad=cos_lat)
+
+
+def _run_haversine(clientes_df, lat_dest, lon_dest, precomputed, dtype):
+    """Modo "haversine": distancia a vuelo de pájaro."""
+    if isinstance(precomputed, dict):
+        return calculate_distance_km_cached(precomputed, lat_dest, lon_dest)
+    if precomputed is not None:
+        return haversine_multi(None, None, [(lat_dest, lon_dest)], precomputed=precomputed)[0]
+    if 'cos_lat_rad' in clientes_df.columns:
+        # Columnas agregadas por prepare_clientes()
+        precomputed = tuple(
+            clientes_df[col].to_numpy(copy=False)
+            for col in ('lat_rad', 'lon_rad', 'cos_lat_rad')
+        )
+        return haversine_multi(None, None, [(lat_dest, lon_dest)], precomputed=precomputed)[0]
+    
+    lat_array, lon_array = _coordenadas_clientes(clientes_df, dtype)
+    return calculate_distance_from_arrays(lat_array, lon_array, lat_dest, lon_dest)
+
+
+def _run_haversine_rank(clientes_df, lat_dest, lon_dest, precomputed, dtype):
+    """Modo "haversine_rank": sólo para ordenar/comparar, omite raíz y arcoseno."""
+    lat_array, lon_array = _coordenadas_clientes(clientes_df, dtype)
+    return haversine_rank_score(lat_array, lon_array, lat_dest, lon_dest)
+
+
+def _run_osrm(clientes_df, lat_dest, lon_dest, precomputed, dtype):
+    """Modo "osrm": distancia de ruteo real, con respaldo Haversine."""
+    return osrm_route_distance_km(clientes_df, lat_dest, lon_dest)
+
+
+# Métodos de cálculo disponibles en calculate_distance_km(); para agregar un
+# modo basta con registrar aquí su función
+_MODES = {
+    'haversine': _run_haversine,
+    'haversine_rank': _run_haversine_rank,
+    'osrm': _run_osrm,
+}
+
+
+def calculate_distance_km(clientes_df, lat_dest, lon_dest, mode="haversine", precomputed=None,
+                          dtype="float32"):
     """
     Interfaz unificada para calcular distancias.
     
@@ -147,51 +777,86 @@ def calculate_distance_km(clientes_df, lat_dest, lon_dest, mode="haversine"):
         mode: Método de cálculo a usar
               - "haversine" (default): Distancia a vuelo de pájaro
               - "osrm": Distancia de ruteo real (requiere servidor OSRM)
+              - "haversine_rank": Puntaje sin unidades que preserva el orden
+                de la distancia Haversine (ver haversine_rank_score); para
+                elegir el más cercano sin calcular kilómetros
+        precomputed: Tupla opcional (lat_rad, lon_rad, cos_lat_rad) de
+                     precompute_trig() o diccionario de build_client_cache()
+                     para los clientes (sólo modo haversine); evita
+                     recalcular radianes y cosenos en cada llamada. Si no se
+                     entrega pero clientes_df tiene las columnas de
+                     prepare_clientes(), se usan esas
+        dtype: Tipo de las coordenadas en el cálculo Haversine. Por defecto
+               float32 (mitad de memoria; error < 1 m para clientes hasta
+               unos 400 km del destino, de sobra para análisis de
+               sucursales). Usar "float64" si se necesita precisión completa
     
     Retorna:
-        Serie de pandas con distancias en kilómetros, un valor por cada cliente
+        Array NumPy con distancias en kilómetros, un valor por cada cliente y
+        en el mismo orden que clientes_df (envolver en pd.Series con
+        clientes_df.index sólo si se necesita el índice)
     
     Uso:
         # HOY: Usar Haversine
         distancias = calculate_distance_km(df_clientes, -23.65, -70.40, mode="haversine")
         
-        # MAÑANA: Cambiar a OSRM (cuando esté implementado)
+        # Distancia por carretera (requiere servidor OSRM)
         distancias = calculate_distance_km(df_clientes, -23.65, -70.40, mode="osrm")
     """
     
-    if mode == "haversine":
-        # Método actual: Haversine (distancia a vuelo de pájaro)
-        lat_array = clientes_df['lat'].values
-        lon_array = clientes_df['lon'].values
-        
-        distancias = haversine_km(lat_array, lon_array, lat_dest, lon_dest)
-        
-        return pd.Series(distancias, index=clientes_df.index)
-    
-    elif mode == "osrm":
-        # Método futuro: OSRM (distancia de ruteo real)
-        # Cuando se implemente, esta línea llamará a la función OSRM
-        return osrm_route_distance_km(clientes_df, lat_dest, lon_dest)
-    
-    else:
+    try:
+        calcular = _MODES[mode]
+    except KeyError:
         raise ValueError(
             f"Modo '{mode}' no reconocido. "
-            f"Opciones válidas: 'haversine', 'osrm'"
-        )
+            f"Opciones válidas: {', '.join(repr(m) for m in _MODES)}"
+        ) from None
+    
+    return calcular(clientes_df, lat_dest, lon_dest, precomputed, dtype)
 
 
-# Funciones auxiliares para el futuro
+# Funciones auxiliares OSRM
 
 def batch_osrm_distances(coordinates_list, osrm_url="http://localhost:5000"):
     """
-    [FUTURO] Calcula distancias en batch usando OSRM table service.
+    Calcula distancias de ruta con una sola petición al servicio 'table' de OSRM.
     
     El servicio 'table' de OSRM es más eficiente para calcular distancias
     de muchos orígenes a muchos destinos.
     
     Ver: http://project-osrm.org/docs/v5.24.0/api/#table-service
+    
+    Parámetros:
+        coordinates_list: Secuencia de tuplas (lat, lon); la última es el
+                          destino y las demás los orígenes (a lo más
+                          OSRM_MAX_COORDENADAS en total)
+        osrm_url: URL del servidor OSRM
+    
+    Retorna:
+        Array NumPy con la distancia en kilómetros de cada origen al destino
+        (NaN donde OSRM no encontró ruta)
+    
+    Lanza OSError si el servidor no responde y ValueError si la respuesta
+    no es válida.
     """
-    pass
+    coords = np.asarray(coordinates_list, dtype=np.float64).reshape(-1, 2)
+    n_origenes = coords.shape[0] - 1
+    
+    # OSRM usa el orden lon,lat
+    coords_str = ";".join(f"{lon:.6f},{lat:.6f}" for lat, lon in coords)
+    sources = ";".join(map(str, range(n_origenes)))
+    url = (f"{osrm_url}/table/v1/driving/{coords_str}"
+           f"?sources={sources}&destinations={n_origenes}&annotations=distance")
+    
+    with urlopen(url, timeout=OSRM_TIMEOUT_S) as response:
+        data = json.load(response)
+    
+    if data.get('code') != 'Ok':
+        raise ValueError(f"Respuesta OSRM: {data.get('code')} {data.get('message', '')}")
+    
+    # distances es una matriz (orígenes x 1) en metros; null si no hay ruta
+    metros = np.array([fila[0] for fila in data['distances']], dtype=np.float64)
+    return metros / 1000.0
 
 
 def validate_osrm_server(osrm_url="http://localhost:5000"):
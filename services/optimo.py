@@ -0,0 +1,111 @@
+"""
+Módulo de cálculo del punto óptimo (geometric median) de un conjunto de clientes.
+
+El punto óptimo minimiza la suma de distancias a todos los clientes y se
+obtiene con el algoritmo de Weiszfeld. Si Numba está disponible, el ciclo
+iterativo se compila a código nativo; si no, se usa una versión NumPy.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+
+
+# Parámetros por defecto del algoritmo de Weiszfeld
+MAX_ITERACIONES = 100
+TOLERANCIA = 1e-6
+
+
+def _weiszfeld_numpy(lat, lon, tol, maxit):
+    """
+    Versión NumPy del algoritmo de Weiszfeld (respaldo si no hay Numba).
+    """
+    coords = np.column_stack((lat, lon)).astype(np.float64)
+    punto_actual = coords.mean(axis=0)
+
+    for _ in range(maxit):
+        # Distancias desde el punto actual a cada cliente (evitando división por cero)
+        distancias = np.sqrt(np.sum((coords - punto_actual) ** 2, axis=1))
+        distancias = np.where(distancias < 1e-8, 1e-8, distancias)
+
+        # Nuevo punto como promedio ponderado por el inverso de la distancia
+        pesos = 1.0 / distancias
+        punto_nuevo = (coords.T @ pesos) / pesos.sum()
+
+        if abs(punto_nuevo[0] - punto_actual[0]) + abs(punto_nuevo[1] - punto_actual[1]) < tol:
+            break
+
+        punto_actual = punto_nuevo
+
+    return float(punto_actual[0]), float(punto_actual[1])
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True, fastmath=True, nogil=True)
+    def _weiszfeld(lat, lon, tol, maxit):
+        """
+        Algoritmo de Weiszfeld compilado con Numba.
+        Cada iteración recorre los clientes una sola vez, acumulando pesos y
+        sumas ponderadas en escalares (sin arreglos temporales). Libera el
+        GIL, por lo que varias sucursales se pueden calcular en paralelo con
+        hilos.
+        """
+        n = lat.shape[0]
+
+        # Iniciar con el centroide como estimación inicial
+        cx = 0.0
+        cy = 0.0
+        for i in range(n):
+            cx += lat[i]
+            cy += lon[i]
+        cx /= n
+        cy /= n
+
+        for _ in range(maxit):
+            sw = 0.0
+            swx = 0.0
+            swy = 0.0
+            for i in range(n):
+                dx = lat[i] - cx
+                dy = lon[i] - cy
+                d = np.sqrt(dx * dx + dy * dy)
+                w = 1.0 / max(d, 1e-8)
+                sw += w
+                swx += w * lat[i]
+                swy += w * lon[i]
+
+            nx = swx / sw
+            ny = swy / sw
+            if abs(nx - cx) + abs(ny - cy) < tol:
+                break
+            cx = nx
+            cy = ny
+
+        return cx, cy
+
+    # Compilar al importar el módulo (float64 y float32) para no pagar el
+    # costo en la primera petición
+    _weiszfeld(np.zeros(2), np.ones(2), TOLERANCIA, 1)
+    _weiszfeld(np.zeros(2, dtype=np.float32), np.ones(2, dtype=np.float32), TOLERANCIA, 1)
+
+
+def geometric_median(lat, lon, tol=TOLERANCIA, maxit=MAX_ITERACIONES):
+    """
+    Calcula el geometric median de un conjunto de puntos (lat, lon).
+
+    Parámetros:
+        lat, lon: Arrays NumPy contiguos (float32 o float64) con las coordenadas
+        tol: Tolerancia de convergencia
+        maxit: Número máximo de iteraciones
+
+    Retorna:
+        Tupla (lat, lon) del punto óptimo como floats de Python
+    """
+    if NUMBA_DISPONIBLE:
+        lat_opt, lon_opt = _weiszfeld(lat, lon, tol, maxit)
+        return float(lat_opt), float(lon_opt)
+    return _weiszfeld_numpy(lat, lon, tol, maxit)
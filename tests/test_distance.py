@@ -0,0 +1,79 @@
+"""
+Precisión del cálculo en float32 frente a float64.
+
+Las coordenadas de clientes se guardan en float32; estas pruebas verifican
+que el error de distancia contra el cálculo en float64 (con las coordenadas
+originales) se mantiene bajo 1 m para clientes a escala de una sucursal
+(hasta ±3° del destino, unos 400 km) a lo largo de Chile.
+"""
+
+import numpy as np
+import pytest
+
+from services.distance import (
+    NUMBA_DISPONIBLE,
+    UMBRAL_KERNEL_HAVERSINE,
+    haversine_km,
+    haversine_multi,
+    precompute_trig,
+)
+
+
+# Error máximo permitido en kilómetros (1 m)
+ERROR_MAXIMO_KM = 1e-3
+
+# Sucursales de norte a sur (Arica, Antofagasta, Santiago, Puerto Montt,
+# Punta Arenas)
+DESTINOS = [
+    (-18.48, -70.31),
+    (-23.65, -70.39),
+    (-33.45, -70.66),
+    (-41.47, -72.94),
+    (-53.15, -70.90),
+]
+
+
+def _clientes_alrededor(lat_dest, lon_dest, n, seed=0):
+    """Clientes aleatorios hasta ±3° del destino (escala de una sucursal)."""
+    rng = np.random.default_rng(seed)
+    lat = lat_dest + rng.uniform(-3.0, 3.0, n)
+    lon = lon_dest + rng.uniform(-3.0, 3.0, n)
+    return lat, lon
+
+
+@pytest.mark.parametrize("lat_dest, lon_dest", DESTINOS)
+def test_haversine_km_numpy_float32(lat_dest, lon_dest):
+    # Menos puntos que el umbral: camino NumPy
+    lat, lon = _clientes_alrededor(lat_dest, lon_dest, UMBRAL_KERNEL_HAVERSINE - 1)
+    referencia = haversine_km(lat, lon, lat_dest, lon_dest)
+    
+    d32 = haversine_km(lat.astype(np.float32), lon.astype(np.float32), lat_dest, lon_dest)
+    
+    assert d32.dtype == np.float32
+    assert np.abs(d32 - referencia).max() < ERROR_MAXIMO_KM
+
+
+@pytest.mark.skipif(not NUMBA_DISPONIBLE, reason="Numba no está instalado")
+@pytest.mark.parametrize("lat_dest, lon_dest", DESTINOS)
+def test_haversine_km_kernel_numba_float32(lat_dest, lon_dest):
+    # Sobre el umbral: kernel Numba
+    lat, lon = _clientes_alrededor(lat_dest, lon_dest, 20 * UMBRAL_KERNEL_HAVERSINE)
+    referencia = haversine_km(lat, lon, lat_dest, lon_dest)
+    
+    d32 = haversine_km(lat.astype(np.float32), lon.astype(np.float32), lat_dest, lon_dest)
+    
+    assert d32.dtype == np.float32
+    assert np.abs(d32 - referencia).max() < ERROR_MAXIMO_KM
+
+
+@pytest.mark.parametrize("lat_dest, lon_dest", DESTINOS)
+def test_haversine_multi_float32(lat_dest, lon_dest):
+    # Mismo camino que /api/analisis_punto: trigonometría precalculada en float32
+    lat, lon = _clientes_alrededor(lat_dest, lon_dest, 20000)
+    referencia = haversine_km(lat, lon, lat_dest, lon_dest)
+    
+    trig = precompute_trig(lat.astype(np.float32), lon.astype(np.float32))
+    d32 = haversine_multi(None, None, [(lat_dest, lon_dest)], precomputed=trig)[0]
+    
+    assert d32.dtype == np.float32
+    assert np.abs(d32 - referencia).max() < ERROR_MAXIMO_KM
@@ -0,0 +1,141 @@
+"""
+Cliente OSRM (servicio 'table') con respaldo Haversine.
+
+urlopen se reemplaza por un servidor falso en memoria: las pruebas verifican
+el tamaño de los lotes, el respaldo por lote ante errores HTTP, el corte
+ante un servidor caído y el respaldo para clientes sin ruta.
+"""
+
+import io
+import json
+from urllib.error import HTTPError, URLError
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import services.distance as distance
+from services.distance import (
+    OSRM_MAX_COORDENADAS,
+    batch_osrm_distances,
+    haversine_km,
+    osrm_route_distance_km,
+)
+
+
+# Distancia que devuelve el servidor falso para cada origen (metros)
+METROS_OSRM = 1234.0
+
+LAT_DEST, LON_DEST = -33.45, -70.66
+
+
+class ServidorFalso:
+    """Reemplazo de urlopen que registra las peticiones y responde como OSRM."""
+
+    def __init__(self, fallas=None, sin_ruta=()):
+        # fallas: número de petición (desde 0) -> excepción a lanzar
+        self.fallas = fallas or {}
+        self.sin_ruta = set(sin_ruta)
+        self.peticiones = []
+
+    def __call__(self, url, timeout=None):
+        numero = len(self.peticiones)
+        partes = urlsplit(url)
+        coords = partes.path.rsplit('/', 1)[-1].split(';')
+        query = parse_qs(partes.query)
+        self.peticiones.append({
+            'coords': coords,
+            'sources': query['sources'][0].split(';'),
+            'destinations': query['destinations'][0],
+        })
+        if numero in self.fallas:
+            raise self.fallas[numero]
+        distancias = [
+            [None if i in self.sin_ruta else METROS_OSRM]
+            for i in range(len(coords) - 1)
+        ]
+        return io.BytesIO(json.dumps({'code': 'Ok', 'distances': distancias}).encode('utf-8'))
+
+
+def _clientes(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'lat': LAT_DEST + rng.uniform(-0.5, 0.5, n),
+        'lon': LON_DEST + rng.uniform(-0.5, 0.5, n),
+    })
+
+
+def _haversine(clientes):
+    return haversine_km(clientes['lat'].to_numpy(), clientes['lon'].to_numpy(), LAT_DEST, LON_DEST)
+
+
+def _error_http(codigo=500):
+    return HTTPError('http://osrm/table', codigo, 'Error', None, None)
+
+
+def test_lotes_de_99_clientes(monkeypatch):
+    servidor = ServidorFalso()
+    monkeypatch.setattr(distance, 'urlopen', servidor)
+    clientes = _clientes(250)
+
+    distancias = osrm_route_distance_km(clientes, LAT_DEST, LON_DEST)
+
+    lote = OSRM_MAX_COORDENADAS - 1
+    assert lote == 99
+    assert [len(p['sources']) for p in servidor.peticiones] == [99, 99, 52]
+    for p in servidor.peticiones:
+        # El destino va al final, en orden lon,lat
+        assert len(p['coords']) == len(p['sources']) + 1 <= OSRM_MAX_COORDENADAS
+        assert p['destinations'] == str(len(p['sources']))
+        assert p['coords'][-1] == f"{LON_DEST:.6f},{LAT_DEST:.6f}"
+    np.testing.assert_allclose(distancias, METROS_OSRM / 1000.0)
+
+
+def test_error_http_usa_respaldo_solo_en_su_lote(monkeypatch):
+    servidor = ServidorFalso(fallas={1: _error_http()})
+    monkeypatch.setattr(distance, 'urlopen', servidor)
+    clientes = _clientes(250)
+
+    distancias = osrm_route_distance_km(clientes, LAT_DEST, LON_DEST)
+
+    # Se siguen consultando los lotes posteriores al que falló
+    assert len(servidor.peticiones) == 3
+    np.testing.assert_allclose(distancias[:99], METROS_OSRM / 1000.0)
+    np.testing.assert_allclose(distancias[99:198], _haversine(clientes)[99:198])
+    np.testing.assert_allclose(distancias[198:], METROS_OSRM / 1000.0)
+
+
+@pytest.mark.parametrize("error", [URLError('Connection refused'), TimeoutError('timed out')])
+def test_servidor_caido_corta_las_peticiones(monkeypatch, error):
+    servidor = ServidorFalso(fallas={0: error})
+    monkeypatch.setattr(distance, 'urlopen', servidor)
+    clientes = _clientes(250)
+
+    distancias = osrm_route_distance_km(clientes, LAT_DEST, LON_DEST)
+
+    # Un solo intento: el resto de los lotes va directo al respaldo
+    assert len(servidor.peticiones) == 1
+    np.testing.assert_allclose(distancias, _haversine(clientes))
+
+
+def test_sin_ruta_queda_nan_en_el_lote(monkeypatch):
+    monkeypatch.setattr(distance, 'urlopen', ServidorFalso(sin_ruta={1, 3}))
+    coords = [(-33.40, -70.60), (-33.41, -70.61), (-33.42, -70.62), (-33.43, -70.63),
+              (LAT_DEST, LON_DEST)]
+
+    distancias = batch_osrm_distances(coords, 'http://osrm')
+
+    assert np.isnan(distancias).tolist() == [False, True, False, True]
+    np.testing.assert_allclose(distancias[[0, 2]], METROS_OSRM / 1000.0)
+
+
+def test_sin_ruta_usa_respaldo_haversine(monkeypatch):
+    monkeypatch.setattr(distance, 'urlopen', ServidorFalso(sin_ruta={0, 5}))
+    clientes = _clientes(10)
+
+    distancias = osrm_route_distance_km(clientes, LAT_DEST, LON_DEST)
+
+    assert not np.isnan(distancias).any()
+    np.testing.assert_allclose(distancias[[0, 5]], _haversine(clientes)[[0, 5]])
+    np.testing.assert_allclose(np.delete(distancias, [0, 5]), METROS_OSRM / 1000.0)